@@ -2,8 +2,11 @@ import os
 
 import streamlit as st
 
+from connect.bq import clear_data_cache
 from pages.pages import (  # page_geo_analysis,; page_overview,; page_source_comparison,; page_temporal_trends,; page_topic_analysis,
     BQ_TABLE_REF,
+    DEBUG,
+    load_dashboard_data,
     page_competition,
     page_emerging_trends,
     page_geo_hotspots,
@@ -37,8 +40,6 @@ url = BASE_URI + "predict"
 
 # st.markdown("Welcome to **VoiceLens** APP.")
 
-GCP_PROJECT = st.secrets["GCP_PROJECT"]
-
 # --- Configuration (Update these BigQuery values) ---
 # The BigQuery connection is automatically configured by Streamlit's st.connection()
 # based on credentials defined in the Streamlit secrets file (secrets.toml).
@@ -74,6 +75,15 @@ with st.sidebar:
     st.header("Navigation")
     selection = st.selectbox("Go to...", list(PAGES.keys()))
 
+    # Query results are cached for an hour; this forces a fresh read from BigQuery
+    if st.button("Refresh data"):
+        clear_data_cache()
+
+    # The BigQuery clients live for the whole server process; in debug mode
+    # they can be rebuilt (e.g. after changing the credentials in the secrets)
+    if DEBUG and st.button("Reset BigQuery connection"):
+        st.cache_resource.clear()
+
     # st.markdown("---")
     # st.info("BASE_URI: **" + BASE_URI)
     # st.info("os.environ: **" + os.environ)
@@ -87,6 +97,11 @@ with st.sidebar:
 # Run the selected page function
 PAGES[selection]()
 
+# Warm the cache for the other pages once the selected one has rendered, so
+# navigating to them is instant. The queries run concurrently in the background
+# (a cache hit when already loaded) and their failures stay off this page.
+load_dashboard_data()
+
 # TODO: Add some titles, introduction, ...
 
 
@@ -1,68 +1,239 @@
+import concurrent.futures
+import datetime
+
+import pandas as pd
 import streamlit as st
-from google.cloud import bigquery
-from google.oauth2 import service_account
 
+# The Google Cloud client libraries are imported inside the functions that use
+# them: they are slow to import, and deferring them lets the sidebar and page
+# header render before the first query needs them.
+
+# Shared pool used to run and download concurrent queries
+_QUERY_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
 
+
+# Secrets are only read here, on first use, and the parsed credentials are
+# shared by the BigQuery and Storage Read clients.
 @st.cache_resource
-def init_connection():
+def _load_credentials():
     """
-    Creates a BigQuery client using the JSON key file path.
+    Loads the credentials and project id from the Streamlit secrets.
     """
-    # # Create credentials object from the file path
-    # credentials = service_account.Credentials.from_service_account_file(
-    #     gcp_sa_path,
-    #     scopes=["https://www.googleapis.com/auth/cloud-platform"],
-    # )
+    import google.auth
+    from google.oauth2 import service_account
 
-    project_id = None
-    credentials = None
     # Streamlit Cloud case: secrets contain the JSON as a dict
     if "gcp_service_account" in st.secrets:
         service_account_info = st.secrets["gcp_service_account"]
         credentials = service_account.Credentials.from_service_account_info(
             service_account_info,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+            scopes=SCOPES,
         )
 
         project_id = service_account_info["project_id"]
 
-    else:
+    elif "GOOGLE_APPLICATION_CREDENTIALS" in st.secrets:
         # Local development case: secrets contain only a file path
         gcp_sa_path = st.secrets["GOOGLE_APPLICATION_CREDENTIALS"]
 
         credentials = service_account.Credentials.from_service_account_file(
             gcp_sa_path,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+            scopes=SCOPES,
         )
 
         project_id = credentials.project_id
 
+    else:
+        # No key in the secrets: use the Application Default Credentials
+        credentials, project_id = google.auth.default(scopes=SCOPES)
+
+    return credentials, project_id
+
 
-    # Initialize client with these credentials
+@st.cache_resource
+def init_connection():
+    """
+    Creates a BigQuery client using the credentials from the secrets.
+    """
+    from google.cloud import bigquery
+
+    credentials, project_id = _load_credentials()
+
+    # Initialize client with these credentials.
+    # Short queries may run without creating a job (results come back inline),
+    # which saves the job insert and polling round-trips on the dashboard reads.
     client = bigquery.Client(
         credentials=credentials,
         project=project_id,
         location="europe-west1",
+        default_job_creation_mode="JOB_CREATION_OPTIONAL",
     )
     return client
 
 
+@st.cache_resource
+def init_bqstorage_connection():
+    """
+    Creates a BigQuery Storage Read client, kept alive so its gRPC channel is reused.
+    """
+    from google.cloud import bigquery_storage
+
+    credentials, _ = _load_credentials()
+    return bigquery_storage.BigQueryReadClient(credentials=credentials)
+
+
+def _query_parameter(name, value):
+    """
+    Builds a BigQuery query parameter from a Python value.
+    The type is inferred unless given as a `(type, value)` tuple; lists become ARRAY parameters.
+    """
+    from google.cloud import bigquery
+
+    if isinstance(value, tuple):
+        param_type, value = value
+        return bigquery.ScalarQueryParameter(name, param_type, value)
+    if isinstance(value, list):
+        item_type = _query_parameter(name, value[0]).type_ if value else "STRING"
+        return bigquery.ArrayQueryParameter(name, item_type, value)
+
+    # bool before int (bool is an int subclass), datetime before date (same reason)
+    if isinstance(value, bool):
+        param_type = "BOOL"
+    elif isinstance(value, int):
+        param_type = "INT64"
+    elif isinstance(value, float):
+        param_type = "FLOAT64"
+    elif isinstance(value, datetime.datetime):
+        param_type = "DATETIME"
+    elif isinstance(value, datetime.date):
+        param_type = "DATE"
+    else:
+        param_type = "STRING"
+    return bigquery.ScalarQueryParameter(name, param_type, value)
+
+
+def _normalize_sql(query):
+    """
+    Canonicalizes the SQL text: drops blank lines, full-line `--` comments and the
+    indentation of each line. The inside of a line (string literals included) is kept.
+    """
+    # BigQuery only serves cached results for byte-identical SQL, so indentation
+    # changes in the page code must not change the text that is sent. Lines stay
+    # newline-separated, so a trailing `--` comment only ends its own line.
+    lines = (line.strip() for line in query.splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("--"))
+
+
+def _job_config(params=None, page=None):
+    """
+    Builds the query job config, binding the optional named @params.
+    Jobs are labelled with the dashboard page for cost attribution.
+    """
+    from google.cloud import bigquery
+
+    labels = {"app": "voicelens"}
+    if page:
+        labels["page"] = page
+
+    # priority is left unset (INTERACTIVE by default): setting it, even to the
+    # default, makes query_and_wait fall back to jobs.insert plus polling
+    return bigquery.QueryJobConfig(
+        query_parameters=[
+            _query_parameter(name, value) for name, value in (params or {}).items()
+        ],
+        use_query_cache=True,
+        labels=labels,
+    )
+
+
+def _run_query(client, bqstorage_client, query, params=None, page=None):
+    """
+    Runs the query, waits for it and returns its result as a DataFrame.
+    """
+    rows = client.query_and_wait(
+        _normalize_sql(query), job_config=_job_config(params, page)
+    )
+
+    # Small results arrive inline with the query response; larger ones are
+    # streamed as Arrow through the Storage Read API. Either way, convert to
+    # Arrow-backed pandas columns without copying into NumPy/object arrays
+    arrow_tbl = rows.to_arrow(bqstorage_client=bqstorage_client)
+    return arrow_tbl.to_pandas(
+        types_mapper=pd.ArrowDtype, self_destruct=True, split_blocks=True
+    )
+
+
 # --- Data Loading Function (Caches results for performance) ---
-@st.cache_data(ttl=600)
-def load_data_from_bq(query):
+# The cache key is the SQL template plus its bound parameters, so the same
+# template with the same @params is served from memory across reruns.
+# The derived tables are rebuilt in batch, so results are kept for an hour;
+# clear_data_cache() drops them on demand.
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch(query, params, page):
     """
-    Runs the SQL query and returns a Pandas DataFrame.
+    Runs the SQL query and returns a DataFrame. Errors are raised (and not cached).
     """
-    try:
-        client = init_connection()
+    # No Streamlit elements in here: it also runs on pool threads for prefetch()
+    return _run_query(
+        init_connection(), init_bqstorage_connection(), query, params, page
+    )
 
-        # Execute the query
-        query_job = client.query(query)
 
-        # Convert directly to DataFrame (most efficient method)
-        df = query_job.to_dataframe()
+def load_data_from_bq(query, params=None, page=None):
+    """
+    Runs the SQL query (with optional named @params) and returns a Pandas DataFrame.
+    """
+    try:
+        # Execute the query (always positional, so prefetch() hits the same entry)
+        df = _fetch(query, params, page)
         return df
 
     except Exception as e:
         st.error(f"Error connecting to BigQuery: {e}")
         st.stop()
+
+
+def prefetch(queries):
+    """
+    Warms the load_data_from_bq cache for each `(query, params, page)`, concurrently.
+    """
+    # Fire and forget: the queries run side by side on the pool without holding
+    # up the script. Failures are dropped here, so they never show up on the page
+    # being viewed; the page that needs the data runs the query and reports them.
+    for query, params, page in queries:
+        _QUERY_POOL.submit(_fetch, query, params, page)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def load_many(queries, page=None):
+    """
+    Runs independent queries concurrently and returns a dict of DataFrames.
+    `queries` maps a name to either a SQL string or a `(query, params)` tuple.
+    """
+    try:
+        client = init_connection()
+        bqstorage_client = init_bqstorage_connection()
+
+        # Each query waits on its own pool thread, so they all run side by
+        # side on BigQuery
+        futures = {}
+        for name, query in queries.items():
+            query, params = query if isinstance(query, tuple) else (query, None)
+            futures[name] = _QUERY_POOL.submit(
+                _run_query, client, bqstorage_client, query, params, page
+            )
+        return {name: future.result() for name, future in futures.items()}
+
+    except Exception as e:
+        st.error(f"Error connecting to BigQuery: {e}")
+        st.stop()
+
+
+def clear_data_cache():
+    """
+    Drops the cached query results so the next run goes back to BigQuery.
+    """
+    _fetch.clear()
+    load_many.clear()
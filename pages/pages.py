@@ -1,20 +1,10 @@
-import os
+import datetime
 
-import altair as alt
-import pandas as pd
 import streamlit as st
 
-from connect.bq import load_data_from_bq
+from connect.bq import load_data_from_bq, load_many, prefetch
 
 # --- Setup & Config ---
-if "API_URI" in os.environ:
-    BASE_URI = st.secrets[os.environ.get("API_URI")]
-else:
-    BASE_URI = st.secrets.get("cloud_api_uri", "")
-
-BASE_URI = BASE_URI if BASE_URI.endswith("/") else BASE_URI + "/"
-url = BASE_URI + "predict"
-
 DEBUG = st.secrets.get("DEBUG", False)
 GCP_PROJECT = st.secrets["GCP_PROJECT"]
 DATASET = st.secrets["DATASET"]
@@ -23,19 +13,246 @@ DUMMY_INSIGHT_TABLE = st.secrets.get("DUMMY_INSIGHT_TABLE", MASTER_INSIGHT_TABLE
 
 # Select table based on debug mode
 INSIGHT_TABLE = MASTER_INSIGHT_TABLE if not DEBUG else DUMMY_INSIGHT_TABLE
-BQ_TABLE_REF = f"`{GCP_PROJECT}.{DATASET}.{INSIGHT_TABLE}`"
-
-
-# --- Helper: Color Scales ---
-# Green for positive, Red for negative
-sentiment_scale = alt.Scale(
-    domain=["positive", "neutral", "negative"], range=["#34d399", "#fbbf24", "#f87171"]
-)
+BQ_SOURCE_TABLE_REF = f"`{GCP_PROJECT}.{DATASET}.{INSIGHT_TABLE}`"
+
+# Pages read the derived `<table>_v2` copy (rebuilt by utils/db.py), where
+# extracted_entities is already parsed into an `entities` ARRAY<STRUCT<text, label>>.
+# It is partitioned by month of `review_day` = DATE(review_date): filter on
+# review_day, not on DATE(review_date), so BigQuery prunes partitions.
+BQ_TABLE_REF = f"`{GCP_PROJECT}.{DATASET}.{INSIGHT_TABLE}_v2`"
+
+# Daily rollup of BQ_TABLE_REF (also rebuilt by utils/db.py): one row per
+# (review_day, predicted_topic, sentiment, location) with review counts `n`,
+# negative counts `neg` and an `is_country_code` flag on the location. Pages that
+# only count reviews read this instead.
+BQ_DAILY_REF = f"`{GCP_PROJECT}.{DATASET}.{INSIGHT_TABLE}_daily`"
+
+# Flattened entity mentions of BQ_TABLE_REF (also rebuilt by utils/db.py): one row
+# per (review, entity) with `entity_text` (trimmed) and `entity_label`.
+BQ_ENTITIES_REF = f"`{GCP_PROJECT}.{DATASET}.{INSIGHT_TABLE}_entities`"
+
+# Root Cause analysis only looks at reviews from this date on
+ROOT_CAUSE_MIN_DATE = datetime.date(2021, 1, 1)
+
+# Own product names left out of the competitor leaderboard (matched lowercased)
+COMPETITION_EXCLUDED = ["hotel marrakesh", "product a"]
+
+# Emerging Trends compares topic volumes on each side of this date
+EMERGING_TRENDS_CUTOFF = datetime.date(2024, 9, 1)
+
+
+# --- Chart Specs ---
+# Hand-written Vega-Lite specs, passed to st.vega_lite_chart with the page's DataFrame.
+# Streamlit ships the frame to the browser as Arrow, so each chart gets only the
+# columns its spec encodes.
+# Built once at import instead of going through Altair's schema validation on every rerun.
+ROOT_CAUSE_LINE_SPEC = {
+    "mark": {"type": "line", "color": "#f87171"},
+    "params": [
+        {"name": "brush", "select": {"type": "interval", "encodings": ["x"]}}
+    ],
+    "encoding": {
+        "x": {"field": "date", "type": "temporal"},
+        "y": {
+            "field": "negative_rate",
+            "type": "quantitative",
+            "axis": {"format": "%"},
+            "title": "Negative Sentiment Rate",
+            "scale": {"domain": [0, 1.1]},  # Adds 10% breathing room at top
+        },
+        "tooltip": [
+            {"field": "date", "type": "temporal"},
+            {"field": "negative_rate", "type": "quantitative", "format": ".1%"},
+        ],
+    },
+    "height": 300,
+    "title": "Sentiment Trend over Selected Period",
+}
+
+# Per-day topic counts, filtered by the brush on the trend line, then summed and
+# cut to the top 4 in the browser: drilling into a window issues no query.
+ROOT_CAUSE_TOPIC_SPEC = {
+    "transform": [
+        {"filter": {"param": "brush"}},
+        {
+            "aggregate": [
+                {"op": "sum", "field": "negative_mentions", "as": "negative_mentions"}
+            ],
+            "groupby": ["simple_topic"],
+        },
+        {
+            "window": [{"op": "row_number", "as": "rank"}],
+            "sort": [{"field": "negative_mentions", "order": "descending"}],
+        },
+        {"filter": "datum.rank <= 4"},
+    ],
+    "mark": {"type": "bar", "color": "#f87171"},
+    "encoding": {
+        "x": {
+            "field": "negative_mentions",
+            "type": "quantitative",
+            "title": "Negative Mentions",
+        },
+        "y": {"field": "simple_topic", "type": "nominal", "sort": "-x", "title": "Topic"},
+        "tooltip": [
+            {"field": "simple_topic", "type": "nominal"},
+            {"field": "negative_mentions", "type": "quantitative"},
+        ],
+    },
+    "title": "Top Negative Topics (drag across the trend to drill down)",
+}
+
+GEO_HOTSPOTS_SPEC = {
+    "mark": "bar",
+    "encoding": {
+        "x": {
+            "field": "negative_pct",
+            "type": "quantitative",
+            "axis": {"format": "%"},
+            "title": "% Negative Reviews",
+            "scale": {"domain": [0, 1.05]},
+        },
+        "y": {"field": "location", "type": "nominal", "sort": "-x", "title": "Location"},
+        "color": {
+            "field": "negative_pct",
+            "type": "quantitative",
+            "scale": {"scheme": "reds"},
+            "title": "Negativity",
+        },
+        "tooltip": [
+            {"field": "location", "type": "nominal"},
+            {"field": "total_reviews", "type": "quantitative"},
+            {"field": "negative_pct", "type": "quantitative", "format": ".1%"},
+        ],
+    },
+    "height": 500,
+}
+
+PRODUCT_FEATURES_SPEC = {
+    "mark": "bar",
+    "encoding": {
+        "x": {
+            "field": "positive_pct",
+            "type": "quantitative",
+            "axis": {"format": "%"},
+            "title": "positive Sentiment %",
+        },
+        "y": {
+            "field": "feature",
+            "type": "nominal",
+            "sort": "-x",
+            "title": "Product Feature",
+        },
+        "color": {
+            "field": "positive_pct",
+            "type": "quantitative",
+            "scale": {"scheme": "redyellowgreen", "domain": [0, 1]},
+            "title": "Sentiment",
+        },
+        "tooltip": [
+            {"field": "feature", "type": "nominal"},
+            {"field": "mentions", "type": "quantitative"},
+            {"field": "positive_pct", "type": "quantitative", "format": ".1%"},
+        ],
+    },
+}
+
+EMERGING_TRENDS_SPEC = {
+    "mark": {"type": "bar", "color": "#818cf8"},
+    "encoding": {
+        "x": {
+            "field": "growth_rate",
+            "type": "quantitative",
+            "axis": {"format": "%"},
+            "title": "Growth Rate",
+        },
+        "y": {"field": "simple_topic", "type": "nominal", "sort": "-x", "title": "Topic"},
+        "tooltip": [
+            {"field": "simple_topic", "type": "nominal"},
+            {"field": "growth_rate", "type": "quantitative", "format": ".1%"},
+            {"field": "vol_recent", "type": "quantitative"},
+        ],
+    },
+}
+
+_COMPETITION_TOOLTIP = [
+    {"field": "competitor", "type": "nominal"},
+    {"field": "mentions", "type": "quantitative"},
+    {"field": "negative_association_pct", "type": "quantitative", "format": ".1%"},
+]
+
+# Option 3 — Horizontal Bar Chart (Best readability if many competitors)
+COMPETITION_BAR_SPEC = {
+    "mark": {"type": "bar", "cornerRadius": 4},
+    "encoding": {
+        "y": {
+            "field": "competitor",
+            "type": "nominal",
+            "sort": "-x",
+            "title": "Competitor",
+        },
+        "x": {"field": "mentions", "type": "quantitative", "title": "Mention Volume"},
+        "color": {
+            "field": "negative_association_pct",
+            "type": "quantitative",
+            "scale": {"scheme": "reds"},
+        },
+        "tooltip": _COMPETITION_TOOLTIP,
+    },
+    "height": 450,
+}
+
+# Option 4 — Scatter Plot With Force-Directed Label Layout (Best but more code)
+COMPETITION_SCATTER_SPEC = {
+    "encoding": {
+        "x": {"field": "mentions", "type": "quantitative", "title": "Mention Volume"},
+        "y": {
+            "field": "negative_association_pct",
+            "type": "quantitative",
+            "title": "% Negative Context",
+            "axis": {"format": "%"},
+        },
+    },
+    "layer": [
+        {
+            "mark": {"type": "circle", "size": 250, "opacity": 0.6},
+            "encoding": {
+                "color": {"field": "competitor", "type": "nominal"},
+                "tooltip": _COMPETITION_TOOLTIP,
+            },
+        },
+        {
+            "mark": {
+                "type": "text",
+                "align": "left",
+                "dx": 10,
+                "dy": 0,
+                "fontSize": 10,
+                "fontWeight": "bold",
+            },
+            "encoding": {"text": {"field": "competitor", "type": "nominal"}},
+        },
+    ],
+    "height": 450,
+}
 
 
 # ==========================================
 # 1. ROOT CAUSE INSIGHT (Sentiment + Topic + Time)
 # ==========================================
+ROOT_CAUSE_TOPIC_QUERY = f"""
+    SELECT
+        review_day as date,
+        DATE_TRUNC(review_day, WEEK(MONDAY)) as week,
+        REPLACE(predicted_topic, 'Topic: ', '') as simple_topic,
+        SUM(neg) as negative_mentions
+    FROM {BQ_DAILY_REF}
+    WHERE sentiment = 'negative'
+    AND review_day >= @min_date
+    GROUP BY 1, 2, 3
+"""
+
+
 def page_root_cause():
     st.title("📉 Root Cause Analysis")
     st.markdown(
@@ -45,25 +262,50 @@ def page_root_cause():
     """
     )
 
-    # 1. PRE-QUERY: Get dynamic Date Bounds from the database (Post-2021)
-    # We run this small query first to know what range to show in the date picker.
-    bounds_query = f"""
+    # 1. Daily series (Post-2021), fetched once for the whole range.
+    # The rows come back sorted by date, so the date picker bounds are simply the
+    # first and last rows; the selected window is filtered in memory.
+    ts_query = f"""
+        WITH daily AS (
+            SELECT
+                review_day as date,
+                SUM(n) as volume,
+                SUM(neg) as neg
+            FROM {BQ_DAILY_REF}
+            WHERE review_day >= @min_date
+            GROUP BY 1
+        )
         SELECT
-            MIN(DATE(review_date)) as min_date,
-            MAX(DATE(review_date)) as max_date
-        FROM {BQ_TABLE_REF}
-        WHERE CAST(review_date AS DATE) >= '2021-01-01'
+            *,
+            DATE_TRUNC(date, WEEK(MONDAY)) as week
+        FROM daily
+        ORDER BY 1
     """
-    bounds_df = load_data_from_bq(bounds_query)
+    # The per-day topic counts cover the same range and run alongside the series query
+    params = {"min_date": ROOT_CAUSE_MIN_DATE}
+    results = load_many(
+        {"daily": (ts_query, params), "topics": (ROOT_CAUSE_TOPIC_QUERY, params)},
+        page="root_cause",
+    )
+    daily_df = results["daily"]
 
     # Set defaults. If DB is empty, fallback to today.
-    if not bounds_df.empty and pd.notnull(bounds_df.iloc[0]["min_date"]):
-        min_db_date = bounds_df.iloc[0]["min_date"]
-        max_db_date = bounds_df.iloc[0]["max_date"]
+    if not daily_df.empty:
+        min_db_date = daily_df["date"].iloc[0]
+        max_db_date = daily_df["date"].iloc[-1]
     else:
-        min_db_date = pd.to_datetime("2021-01-01").date()
-        max_db_date = pd.to_datetime("today").date()
+        min_db_date = ROOT_CAUSE_MIN_DATE
+        max_db_date = datetime.date.today()
+
+    _root_cause_drilldown(daily_df, results["topics"], min_db_date, max_db_date)
+
 
+@st.fragment
+def _root_cause_drilldown(daily_df, daily_topic_df, min_db_date, max_db_date):
+    """
+    Date inputs, trend chart and topic drill-down of the Root Cause page.
+    Runs as a fragment: changing the dates reruns only this block.
+    """
     # 2. Date Inputs (Dynamic Defaults)
     col1, col2 = st.columns(2)
 
@@ -78,210 +320,259 @@ def page_root_cause():
         st.error("Error: End date must fall after start date.")
         return
 
-    # 3. Time Series Chart (Dynamic Query)
-    # Uses LOWER() for safety and filters >= 2021
-    ts_query = f"""
-        SELECT
-            DATE(review_date) as date,
-            COUNT(review_id) as volume,
-            SAFE_DIVIDE(COUNTIF(LOWER(predicted_sentiment) = 'negative'), COUNT(review_id)) as negative_rate
-        FROM {BQ_TABLE_REF}
-        WHERE DATE(review_date) BETWEEN '{start_date}' AND '{end_date}'
-        GROUP BY 1
-        ORDER BY 1
-    """
-    ts_df = load_data_from_bq(ts_query)
-
-    if not ts_df.empty:
-        # Interactive Selection Brush
-        brush = alt.selection_interval(encodings=["x"], name="brush")
-
-        base = alt.Chart(ts_df).encode(x="date:T")
-
-        line = (
-            base.mark_line(color="#f87171")
-            .encode(
-                y=alt.Y(
-                    "negative_rate",
-                    axis=alt.Axis(format="%"),
-                    title="Negative Sentiment Rate",
-                    scale=alt.Scale(domain=[0, 1.1]),  # Adds 10% breathing room at top
-                ),
-                tooltip=["date", alt.Tooltip("negative_rate", format=".1%")],
-            )
-            .add_params(brush)
-            .properties(height=300, title="Sentiment Trend over Selected Period")
-        )
+    # 3. In-memory slices of the daily series and of the per-day topic counts
+    ts_df = daily_df[daily_df["date"].between(start_date, end_date)]
+    topic_df = daily_topic_df[daily_topic_df["date"].between(start_date, end_date)]
 
-        st.altair_chart(line, use_container_width=True)
+    # Past a year, bucket to weeks: keeps the chart readable and its payload small
+    if (end_date - start_date).days > 365:
+        ts_df = (
+            ts_df.groupby("week", as_index=False)[["volume", "neg"]]
+            .sum()
+            .rename(columns={"week": "date"})
+        )
+        topic_df = (
+            topic_df.groupby(["week", "simple_topic"], as_index=False)["negative_mentions"]
+            .sum()
+            .rename(columns={"week": "date"})
+        )
 
-        # 4. Root Cause Topic Query
-        st.subheader(f"Top Negative Topics ({start_date} to {end_date})")
+    ts_df = ts_df.assign(negative_rate=ts_df["neg"] / ts_df["volume"])
 
-        topic_query = f"""
-            SELECT
-                REPLACE(predicted_topic, 'Topic: ', '') as simple_topic,
-                COUNT(review_id) as negative_mentions
-            FROM {BQ_TABLE_REF}
-            WHERE LOWER(predicted_sentiment) = 'negative'
-            AND DATE(review_date) BETWEEN '{start_date}' AND '{end_date}'
-            GROUP BY 1
-            ORDER BY 2 DESC
-            LIMIT 4
-        """
-        topic_df = load_data_from_bq(topic_query)
+    if ts_df.empty:
+        st.warning("No data found for this date range.")
+        return
 
+    # 4. Trend line with an interval brush, topic bars below it filtered by
+    # the brush. One spec, so the selection drives the bars client-side.
+    # A single day leaves nothing to brush: only the trend line is skipped, and
+    # the topic bars are drawn on their own, without the brush filter.
+    if len(ts_df) < 2:
+        st.info(f"Only one day of data in this range ({ts_df['date'].iloc[0]}).")
         if not topic_df.empty:
-            chart = (
-                alt.Chart(topic_df)
-                .mark_bar(color="#f87171")
-                .encode(
-                    x=alt.X("negative_mentions", title="Negative Mentions"),
-                    y=alt.Y("simple_topic", sort="-x", title="Topic"),
-                    tooltip=["simple_topic", "negative_mentions"],
-                )
-            )
-            st.altair_chart(chart, use_container_width=True)
-
-            top_issue = topic_df.iloc[0]["simple_topic"]
-            st.error(
-                f"🚨 **Root Cause Identified:** The spike in negative sentiment is primarily driven by **'{top_issue}'**."
+            topic_spec = {
+                **ROOT_CAUSE_TOPIC_SPEC,
+                "transform": ROOT_CAUSE_TOPIC_SPEC["transform"][1:],
+                "title": "Top Negative Topics",
+            }
+            st.vega_lite_chart(
+                topic_df[["date", "simple_topic", "negative_mentions"]],
+                topic_spec,
+                use_container_width=True,
             )
-        else:
-            st.warning("No negative reviews found in this selected date range.")
     else:
-        st.warning("No data found for this date range.")
+        drilldown_spec = {
+            "vconcat": [
+                {**ROOT_CAUSE_LINE_SPEC, "data": {"name": "series"}},
+                {**ROOT_CAUSE_TOPIC_SPEC, "data": {"name": "topics"}},
+            ],
+            # Only the encoded columns are shipped to the browser
+            "datasets": {
+                "series": ts_df[["date", "negative_rate"]],
+                "topics": topic_df[["date", "simple_topic", "negative_mentions"]],
+            },
+        }
+        st.vega_lite_chart(None, drilldown_spec, use_container_width=True)
+
+    if topic_df.empty:
+        st.warning("No negative reviews found in this selected date range.")
+        return
+
+    top_issue = topic_df.groupby("simple_topic")["negative_mentions"].sum().idxmax()
+    st.error(
+        f"🚨 **Root Cause Identified:** The spike in negative sentiment is primarily driven by **'{top_issue}'**."
+    )
 
 
 # ==========================================
 # 2. GEOGRAPHICAL HOTSPOTS (Location + Sentiment)
 # ==========================================
+# FIX: Rewrote SAFE_DIVIDE denominator to ensure non-NULL sentiment is counted.
+GEO_HOTSPOTS_QUERY = f"""
+    SELECT
+        location,
+        SUM(n) as total_reviews,
+        SAFE_DIVIDE(
+            SUM(neg),
+            SUM(IF(sentiment IS NOT NULL, n, 0))
+        ) as negative_pct
+    FROM {BQ_DAILY_REF}
+    WHERE is_country_code
+      --AND REGEXP_CONTAINS(location, r'^[A-Z]{{2}}$')
+      --AND review_day >= '2021-01-01'
+    GROUP BY 1
+    HAVING total_reviews > 0
+    ORDER BY negative_pct DESC
+    --LIMIT 20
+"""
+
+
+@st.fragment
 def page_geo_hotspots():
     st.title("🌍 Geographical Hotspots")
     st.markdown("**Goal:** Identify regions with specific support or logistics issues.")
 
-    # FIX: Rewrote SAFE_DIVIDE denominator to ensure non-NULL sentiment is counted.
-    geo_query = f"""
-        SELECT
-            location,
-            COUNT(review_id) as total_reviews,
-            SAFE_DIVIDE(
-                COUNTIF(LOWER(predicted_sentiment) = 'negative'),
-                COUNTIF(predicted_sentiment IS NOT NULL)
-            ) as negative_pct
-        FROM {BQ_TABLE_REF}
-        WHERE location IS NOT NULL
-          AND LENGTH(location) = 2
-          --AND REGEXP_CONTAINS(location, r'^[A-Z]{{2}}$')
-          --AND CAST(review_date AS DATE) >= '2021-01-01'
-        GROUP BY 1
-        HAVING total_reviews > 0
-        ORDER BY negative_pct DESC
-        --LIMIT 20
-    """
-    geo_df = load_data_from_bq(geo_query)
-
-    if not geo_df.empty:
-        st.subheader("Regions by Negative Sentiment Rate")
-
-        chart = (
-            alt.Chart(geo_df)
-            .mark_bar()
-            .encode(
-                x=alt.X(
-                    "negative_pct",
-                    axis=alt.Axis(format="%"),
-                    title="% Negative Reviews",
-                    scale=alt.Scale(domain=[0, 1.05]),
-                ),
-                y=alt.Y("location", sort="-x", title="Location"),
-                color=alt.Color(
-                    "negative_pct", scale=alt.Scale(scheme="reds"), title="Negativity"
-                ),
-                tooltip=[
-                    "location",
-                    "total_reviews",
-                    alt.Tooltip("negative_pct", format=".1%"),
-                ],
-            )
-            .properties(height=500)
-        )
+    geo_df = load_page_data("geo_hotspots")
 
-        st.altair_chart(chart, use_container_width=True)
-
-        # # Option A — Vertical Expansion + Scrollable Chart (Best UX in Streamlit)
-        # # FIXED height chart (doesn’t expand)
-        # chart = (
-        #     alt.Chart(geo_df)
-        #     .mark_bar()
-        #     .encode(
-        #         x=alt.X(
-        #             "negative_pct",
-        #             axis=alt.Axis(format="%"),
-        #             title="% Negative Reviews",
-        #             scale=alt.Scale(domain=[0, 1.05]),
-        #         ),
-        #         y=alt.Y("location:N", sort="-x", title="Location"),
-        #         color=alt.Color("negative_pct:Q", scale=alt.Scale(scheme="reds")),
-        #         tooltip=[
-        #             "location",
-        #             "total_reviews",
-        #             alt.Tooltip("negative_pct:Q", format=".1%"),
-        #         ],
-        #     )
-        #     .properties(width="container", height=2500)   # <— increased height
-        # )
-
-        # # scrollable container
-        # st.markdown("""
-        # <div style="height:700px; overflow-y: scroll; border:1px solid #ddd; padding:10px;">
-        # """, unsafe_allow_html=True)
-
-        # st.altair_chart(chart, use_container_width=True)
-        # st.markdown("</div>", unsafe_allow_html=True)
-
-        # # Option B — Switch to a Choropleth Map (Best visualization for many regions)
-        # import altair as alt
-        # from vega_datasets import data
-
-        # countries = data.world_110m()
-        # geojson = alt.topo_feature(countries, "countries")
-
-        # df_geo = geo_df.rename(columns={"location": "id"})  # id must match ISO code
-
-        # chart = alt.Chart(geojson).mark_geoshape().encode(
-        #     color=alt.Color("negative_pct:Q", scale=alt.Scale(scheme="reds"), title="% Negative"),
-        #     tooltip=["id:N", alt.Tooltip("negative_pct:Q", format=".1%"), "total_reviews:Q"]
-        # ).transform_lookup(
-        #     lookup="id",
-        #     from_=alt.LookupData(df_geo, "id", ["negative_pct", "total_reviews"])
-        # ).properties(
-        #     width="container",
-        #     height=550
-        # ).project("naturalEarth1")
-
-        # st.altair_chart(chart, use_container_width=True)
-
-        # # Option C — Paginated Table + Sparkline (Super clean)
-        # st.dataframe(
-        #     geo_df.sort_values("negative_pct", ascending=False)
-        #         .style.background_gradient(subset=["negative_pct"], cmap="Reds")
-        # )
-
-        # Worst Location Information
-        worst_loc = geo_df.iloc[0]["location"]
-        st.warning(
-            f"📍 **Action Required:** **{worst_loc}** is showing the highest rate of customer dissatisfaction."
-        )
-    else:
+    if geo_df.empty:
         st.warning(
             "No valid location data found (looking for 2-letter country codes post-2021)."
         )
+        return
+
+    st.subheader("Regions by Negative Sentiment Rate")
+
+    st.vega_lite_chart(geo_df, GEO_HOTSPOTS_SPEC, use_container_width=True)
+
+    # # Option A — Vertical Expansion + Scrollable Chart (Best UX in Streamlit)
+    # # FIXED height chart (doesn’t expand)
+    # chart = (
+    #     alt.Chart(geo_df)
+    #     .mark_bar()
+    #     .encode(
+    #         x=alt.X(
+    #             "negative_pct",
+    #             axis=alt.Axis(format="%"),
+    #             title="% Negative Reviews",
+    #             scale=alt.Scale(domain=[0, 1.05]),
+    #         ),
+    #         y=alt.Y("location:N", sort="-x", title="Location"),
+    #         color=alt.Color("negative_pct:Q", scale=alt.Scale(scheme="reds")),
+    #         tooltip=[
+    #             "location",
+    #             "total_reviews",
+    #             alt.Tooltip("negative_pct:Q", format=".1%"),
+    #         ],
+    #     )
+    #     .properties(width="container", height=2500)   # <— increased height
+    # )
+
+    # # scrollable container
+    # st.markdown("""
+    # <div style="height:700px; overflow-y: scroll; border:1px solid #ddd; padding:10px;">
+    # """, unsafe_allow_html=True)
+
+    # st.altair_chart(chart, use_container_width=True)
+    # st.markdown("</div>", unsafe_allow_html=True)
+
+    # # Option B — Switch to a Choropleth Map (Best visualization for many regions)
+    # import altair as alt
+    # from vega_datasets import data
+
+    # countries = data.world_110m()
+    # geojson = alt.topo_feature(countries, "countries")
+
+    # df_geo = geo_df.rename(columns={"location": "id"})  # id must match ISO code
+
+    # chart = alt.Chart(geojson).mark_geoshape().encode(
+    #     color=alt.Color("negative_pct:Q", scale=alt.Scale(scheme="reds"), title="% Negative"),
+    #     tooltip=["id:N", alt.Tooltip("negative_pct:Q", format=".1%"), "total_reviews:Q"]
+    # ).transform_lookup(
+    #     lookup="id",
+    #     from_=alt.LookupData(df_geo, "id", ["negative_pct", "total_reviews"])
+    # ).properties(
+    #     width="container",
+    #     height=550
+    # ).project("naturalEarth1")
+
+    # st.altair_chart(chart, use_container_width=True)
+
+    # # Option C — Paginated Table + Sparkline (Super clean)
+    # st.dataframe(
+    #     geo_df.sort_values("negative_pct", ascending=False)
+    #         .style.background_gradient(subset=["negative_pct"], cmap="Reds")
+    # )
+
+    # Worst Location Information
+    worst_loc = geo_df["location"].iloc[0]
+    st.warning(
+        f"📍 **Action Required:** **{worst_loc}** is showing the highest rate of customer dissatisfaction."
+    )
 
 
 # ==========================================
 # 3. PRODUCT FEATURE INSIGHT (Best & Worst)
 # ==========================================
+# The Product Features and Competitive Intel leaderboards both come from the
+# flattened entity mentions (see utils/db.py), so they share one job:
+# - features: entities labelled PRODUCT or METRIC, the 20 most mentioned,
+#   ordered by sentiment so the best/worst 3 are the first/last rows
+# - competitors: entities labelled ORG, TEAM, or PRODUCT, minus our own names,
+#   the 10 most mentioned
+ENTITY_BOARDS_QUERY = f"""
+    WITH mentions AS (
+        SELECT
+            entity_text as competitor,
+            LOWER(entity_text) as feature,
+            entity_label as label,
+            predicted_sentiment
+        FROM {BQ_ENTITIES_REF}
+        WHERE entity_label IN ('PRODUCT', 'METRIC', 'ORG', 'TEAM')
+    ),
+    -- Leaderboards: APPROX_TOP_COUNT picks the most mentioned entities without
+    -- grouping and sorting every distinct one; the exact mention counts and
+    -- sentiment shares are then aggregated from the join, for those few only
+    top_features AS (
+        SELECT value as feature
+        FROM UNNEST((
+            SELECT APPROX_TOP_COUNT(feature, 20)
+            FROM mentions
+            WHERE label IN ('PRODUCT', 'METRIC')
+        ))
+    ),
+    top_competitors AS (
+        SELECT value as competitor
+        FROM UNNEST((
+            SELECT APPROX_TOP_COUNT(competitor, 10)
+            FROM mentions
+            WHERE label IN ('ORG', 'TEAM', 'PRODUCT')
+            AND feature NOT LIKE '%voicelens%'
+            -- Exclude your own main product names if needed:
+            AND feature NOT IN UNNEST(@excluded)
+        ))
+    ),
+    features AS (
+        SELECT
+            'feature' as board,
+            t.feature,
+            CAST(NULL AS STRING) as competitor,
+            COUNT(*) as mentions,
+            SAFE_DIVIDE(COUNTIF(m.predicted_sentiment = 'positive'), COUNT(*)) as positive_pct,
+            CAST(NULL AS FLOAT64) as negative_association_pct
+        FROM top_features t
+        JOIN mentions m ON m.feature = t.feature
+        WHERE m.label IN ('PRODUCT', 'METRIC')
+        GROUP BY 2
+    ),
+    competitors AS (
+        SELECT
+            'competitor' as board,
+            CAST(NULL AS STRING) as feature,
+            t.competitor,
+            COUNT(*) as mentions,
+            CAST(NULL AS FLOAT64) as positive_pct,
+            SAFE_DIVIDE(COUNTIF(m.predicted_sentiment = 'negative'), COUNT(*)) as negative_association_pct
+        FROM top_competitors t
+        JOIN mentions m ON m.competitor = t.competitor
+        WHERE m.label IN ('ORG', 'TEAM', 'PRODUCT')
+        GROUP BY 3
+    )
+    SELECT * FROM features
+    UNION ALL
+    SELECT * FROM competitors
+    ORDER BY board, positive_pct DESC, mentions DESC
+"""
+
+
+def _load_entity_boards(board):
+    """
+    Returns one of the entity leaderboards ("feature" or "competitor").
+    """
+    df = load_page_data("entity_boards")
+    return df[df["board"] == board].reset_index(drop=True)
+
+
+@st.fragment
 def page_product_features():
     st.title("🛠️ Product Feature Analysis")
     st.markdown(
@@ -291,281 +582,222 @@ def page_product_features():
     """
     )
 
-    # --- UPDATED QUERY FOR NEW DATA FORMAT ---
-    # New Format: [('text', 'LABEL'), ('text', 'LABEL')]
-    # Method: Use REGEXP_EXTRACT_ALL to find the 'text' where the label is PRODUCT or METRIC.
-    # Pattern explanation: \('([^']*)', '(?:PRODUCT|METRIC)'\)
-    #   \('      -> matches literal ('
-    #   ([^']*)  -> Capture Group 1: Matches the text (assuming no internal single quotes)
-    #   ', '     -> matches literal ', '
-    #   (?:...)  -> Non-capturing group for OR logic
-    #   '\)      -> matches literal ')
-
-    feature_query = f"""
-        SELECT
-            TRIM(LOWER(matches)) as feature,
-            COUNT(*) as mentions,
-            SAFE_DIVIDE(COUNTIF(predicted_sentiment = 'positive'), COUNT(*)) as positive_pct
-        FROM {BQ_TABLE_REF},
-        UNNEST(REGEXP_EXTRACT_ALL(extracted_entities, r"\('([^']*)', '(?:PRODUCT|METRIC)'\)")) as matches
-        GROUP BY 1
-        HAVING mentions > 0
-        ORDER BY mentions DESC
-        LIMIT 20
-    """
+    df = _load_entity_boards("feature")[["feature", "mentions", "positive_pct"]]
 
-    df = load_data_from_bq(feature_query)
-
-    if not df.empty:
-        # 1. Display the Chart
-        st.subheader("Sentiment by Component/Feature")
-        chart = (
-            alt.Chart(df)
-            .mark_bar()
-            .encode(
-                x=alt.X(
-                    "positive_pct",
-                    axis=alt.Axis(format="%"),
-                    title="positive Sentiment %",
-                ),
-                y=alt.Y("feature", sort="-x", title="Product Feature"),
-                color=alt.Color(
-                    "positive_pct",
-                    scale=alt.Scale(scheme="redyellowgreen", domain=[0, 1]),
-                    title="Sentiment",
-                ),
-                tooltip=[
-                    "feature",
-                    "mentions",
-                    alt.Tooltip("positive_pct", format=".1%"),
-                ],
-            )
-        )
-        st.altair_chart(chart, use_container_width=True)
+    if df.empty:
+        st.warning("No product features found in the current dataset.")
+        return
 
-        st.markdown("---")
+    # 1. Display the Chart
+    st.subheader("Sentiment by Component/Feature")
+    st.vega_lite_chart(df, PRODUCT_FEATURES_SPEC, use_container_width=True)
 
-        # 2. Display Best 3 and Lowest 3
-        col1, col2 = st.columns(2)
+    st.markdown("---")
 
-        df_sorted = df.sort_values(by="positive_pct", ascending=False)
+    # 2. Display Best 3 and Lowest 3
+    # Labels are title-cased once, vectorized over the column, and the rows are
+    # converted to plain dicts in one call
+    rows = (
+        df.assign(feature_title=df["feature"].str.title())
+        .loc[:, ["feature_title", "positive_pct"]]
+        .to_dict(orient="records")
+    )
+    col1, col2 = st.columns(2)
 
-        with col1:
-            st.success("✅ **Top 3 Best Performing Features**")
-            top_3 = df_sorted.head(3)
-            for index, row in top_3.iterrows():
-                st.metric(
-                    label=row["feature"].title(),
-                    value=f"{row['positive_pct']*100:.0f}% positive",
-                    delta="Great",
-                )
+    with col1:
+        st.success("✅ **Top 3 Best Performing Features**")
+        for row in rows[:3]:
+            st.metric(
+                label=row["feature_title"],
+                value=f"{row['positive_pct']*100:.0f}% positive",
+                delta="Great",
+            )
 
-        with col2:
-            st.error("⚠️ **Lowest 3 Performing Features**")
-            bottom_3 = df_sorted.tail(3).sort_values(by="positive_pct", ascending=True)
-            for index, row in bottom_3.iterrows():
-                st.metric(
-                    label=row["feature"].title(),
-                    value=f"{row['positive_pct']*100:.0f}% positive",
-                    delta="- Critical",
-                    delta_color="inverse",
-                )
+    with col2:
+        st.error("⚠️ **Lowest 3 Performing Features**")
+        # Rows are ordered by positive_pct in SQL: the worst are the last ones
+        for row in rows[:-4:-1]:
+            st.metric(
+                label=row["feature_title"],
+                value=f"{row['positive_pct']*100:.0f}% positive",
+                delta="- Critical",
+                delta_color="inverse",
+            )
 
 
 # ==========================================
 # 4. EMERGING TRENDS (Topic + Growth)
 # ==========================================
+# One pass over the daily rollup: each topic's volume on either side of the
+# cutoff comes from conditional sums, with no self-join. The period test is
+# on the review_day column directly (no CAST(review_date AS DATE)).
+# Each sum is computed once in `volumes`; the projection only combines them.
+EMERGING_TRENDS_QUERY = f"""
+    WITH volumes AS (
+        SELECT
+            REPLACE(predicted_topic, 'Topic: ', '') as simple_topic,
+            SUM(IF(review_day >= @cutoff, n, 0)) as vol_recent,
+            SUM(IF(review_day < @cutoff, n, 0)) as vol_past_raw
+        FROM {BQ_DAILY_REF}
+        GROUP BY 1
+    )
+    SELECT
+        simple_topic,
+        vol_recent,
+        GREATEST(vol_past_raw, 1) as vol_past,
+        SAFE_DIVIDE(vol_recent - vol_past_raw, GREATEST(vol_past_raw, 1)) as growth_rate
+    FROM volumes
+    WHERE vol_recent > 0
+    ORDER BY growth_rate DESC
+    LIMIT 10
+"""
+
+
+@st.fragment
 def page_emerging_trends():
     st.title("🚀 Emerging Trends & Requests")
     st.markdown("**Goal:** Identifies topics exploding in volume (Month-over-Month).")
 
-    # Using CAST(review_date as DATE) to be safe with DATETIME comparison
-    trend_query = f"""
-        WITH recent_stats AS (
-            SELECT predicted_topic, COUNT(review_id) as vol_recent
-            FROM {BQ_TABLE_REF}
-            WHERE CAST(review_date AS DATE) >= '2024-09-01'
-            GROUP BY 1
-        ),
-        past_stats AS (
-            SELECT predicted_topic, COUNT(review_id) as vol_past
-            FROM {BQ_TABLE_REF}
-            WHERE CAST(review_date AS DATE) < '2024-09-01'
-            GROUP BY 1
-        )
-        SELECT
-            REPLACE(r.predicted_topic, 'Topic: ', '') as simple_topic,
-            r.vol_recent,
-            COALESCE(p.vol_past, 1) as vol_past,
-            SAFE_DIVIDE((r.vol_recent - COALESCE(p.vol_past, 0)), COALESCE(p.vol_past, 1)) as growth_rate
-        FROM recent_stats r
-        LEFT JOIN past_stats p ON r.predicted_topic = p.predicted_topic
-        WHERE r.vol_recent > 0
-        ORDER BY growth_rate DESC
-        LIMIT 10
-    """
-    df = load_data_from_bq(trend_query)
-
-    if not df.empty:
-        st.subheader("Fastest Growing Topics (Comparison)")
-
-        chart = (
-            alt.Chart(df)
-            .mark_bar(color="#818cf8")
-            .encode(
-                x=alt.X("growth_rate", axis=alt.Axis(format="%"), title="Growth Rate"),
-                y=alt.Y("simple_topic", sort="-x", title="Topic"),
-                tooltip=[
-                    "simple_topic",
-                    alt.Tooltip("growth_rate", format=".1%"),
-                    "vol_recent",
-                ],
-            )
-        )
-        st.altair_chart(chart, use_container_width=True)
+    df = load_page_data("emerging_trends")
 
-        top_trend = df.iloc[0]["simple_topic"]
-        st.info(
-            f"📈 **Strategic Opportunity:** Users are suddenly talking about **'{top_trend}'**."
-        )
-    else:
+    if df.empty:
         st.warning("Not enough data to calculate trends yet.")
+        return
+
+    st.subheader("Fastest Growing Topics (Comparison)")
+
+    # vol_past is not encoded: keep it out of the chart payload
+    st.vega_lite_chart(
+        df[["simple_topic", "growth_rate", "vol_recent"]],
+        EMERGING_TRENDS_SPEC,
+        use_container_width=True,
+    )
+
+    top_trend = df["simple_topic"].iloc[0]
+    st.info(
+        f"📈 **Strategic Opportunity:** Users are suddenly talking about **'{top_trend}'**."
+    )
 
 
 # ==========================================
 # 5. COMPETITIVE INTELLIGENCE (NER + Sentiment)
 # ==========================================
+@st.fragment
 def page_competition():
     st.title("⚔️ Competitive Intelligence")
     st.markdown("**Goal:** Analyze sentiment when customers mention competitors.")
 
-    # --- UPDATED QUERY FOR NEW DATA FORMAT ---
-    # Pattern: \('([^']*)', '(?:ORG|TEAM|PRODUCT)'\)
-    # Captures text where label is ORG, TEAM, or PRODUCT
-    comp_query = f"""
-        SELECT
-            TRIM(matches) as competitor,
-            COUNT(*) as mentions,
-            SAFE_DIVIDE(COUNTIF(predicted_sentiment = 'negative'), COUNT(*)) as negative_association_pct
-        FROM {BQ_TABLE_REF},
-        UNNEST(REGEXP_EXTRACT_ALL(extracted_entities, r"\('([^']*)', '(?:ORG|TEAM|PRODUCT)'\)")) as matches
-        WHERE LOWER(matches) NOT LIKE '%voicelens%'
-        -- Exclude your own main product names if needed:
-        AND LOWER(matches) NOT IN ('hotel marrakesh', 'product a')
-        GROUP BY 1
-        HAVING mentions > 0
-        ORDER BY mentions DESC
-        LIMIT 10
-    """
-    df = load_data_from_bq(comp_query)
-
-    if not df.empty:
-        st.subheader("Competitor/Entity Sentiment Association")
-
-        # chart = (
-        #     alt.Chart(df)
-        #     .mark_circle()
-        #     .encode(
-        #         x=alt.X("mentions", title="Mention Volume"),
-        #         y=alt.Y(
-        #             "negative_association_pct",
-        #             axis=alt.Axis(format="%"),
-        #             title="% Negative Context",
-        #         ),
-        #         size=alt.value(200),
-        #         color=alt.Color("competitor", legend=None),
-        #         tooltip=[
-        #             "competitor",
-        #             "mentions",
-        #             alt.Tooltip("negative_association_pct", format=".1%"),
-        #         ],
-        #     )
-        #     .mark_text(align="left", dx=15)
-        #     .encode(text="competitor")
-        # )
-        # st.altair_chart(chart, use_container_width=True)
-
-        # # Chart: Option 1 — Bubble Chart With Non-Overlapping Labels (Tooltips Only)
-        # chart = (
-        #     alt.Chart(df)
-        #     .mark_circle(opacity=0.7)
-        #     .encode(
-        #         x=alt.X("mentions", title="Mention Volume"),
-        #         y=alt.Y("negative_association_pct", title="% Negative Context", axis=alt.Axis(format="%")),
-        #         size=alt.Size("mentions", scale=alt.Scale(range=[100, 1500])),
-        #         color=alt.Color("competitor:N", title="Competitor"),
-        #         tooltip=[
-        #             alt.Tooltip("competitor:N", title="Competitor"),
-        #             alt.Tooltip("mentions:Q", title="Mentions"),
-        #             alt.Tooltip("negative_association_pct:Q", title="Neg. %", format=".1%"),
-        #         ],
-        #     )
-        # ).properties(height=450)
-
-        # st.altair_chart(chart, use_container_width=True)
-
-        # # Chart: Option 2 — Bubble Chart With Labels Inside Circles
-        # base = alt.Chart(df).encode(
-        #     x=alt.X("mentions", title="Mention Volume"),
-        #     y=alt.Y("negative_association_pct", title="% Negative Context", axis=alt.Axis(format="%")),
-        # )
-
-        # circles = base.mark_circle(opacity=0.6).encode(
-        #     size=alt.Size("mentions", scale=alt.Scale(range=[200, 1800])),
-        #     color=alt.Color("competitor:N", legend=None),
-        # )
-
-        # labels = base.mark_text(
-        #     dy=2,  # slight downward offset
-        #     fontSize=10,
-        #     fontWeight="bold",
-        #     color="white",
-        # ).encode(text="competitor:N")
-
-        # chart = (circles + labels).properties(height=450)
-
-        # st.altair_chart(chart, use_container_width=True)
-        # Chart: Option 3 — Horizontal Bar Chart (Best readability if many competitors)
-        chart = (
-            alt.Chart(df)
-            .mark_bar(cornerRadius=4)
-            .encode(
-                y=alt.Y("competitor:N", sort="-x", title="Competitor"),
-                x=alt.X("mentions:Q", title="Mention Volume"),
-                color=alt.Color("negative_association_pct:Q", scale=alt.Scale(scheme="reds")),
-                tooltip=[
-                    "competitor",
-                    "mentions",
-                    alt.Tooltip("negative_association_pct", format=".1%"),
-                ],
-            )
-        ).properties(height=450)
+    df = _load_entity_boards("competitor")[
+        ["competitor", "mentions", "negative_association_pct"]
+    ]
 
-        st.altair_chart(chart, use_container_width=True)
+    if df.empty:
+        st.warning("No competitor mentions found in the current dataset.")
+        return
 
+    st.subheader("Competitor/Entity Sentiment Association")
+
+    # chart = (
+    #     alt.Chart(df)
+    #     .mark_circle()
+    #     .encode(
+    #         x=alt.X("mentions", title="Mention Volume"),
+    #         y=alt.Y(
+    #             "negative_association_pct",
+    #             axis=alt.Axis(format="%"),
+    #             title="% Negative Context",
+    #         ),
+    #         size=alt.value(200),
+    #         color=alt.Color("competitor", legend=None),
+    #         tooltip=[
+    #             "competitor",
+    #             "mentions",
+    #             alt.Tooltip("negative_association_pct", format=".1%"),
+    #         ],
+    #     )
+    #     .mark_text(align="left", dx=15)
+    #     .encode(text="competitor")
+    # )
+    # st.altair_chart(chart, use_container_width=True)
+
+    # # Chart: Option 1 — Bubble Chart With Non-Overlapping Labels (Tooltips Only)
+    # chart = (
+    #     alt.Chart(df)
+    #     .mark_circle(opacity=0.7)
+    #     .encode(
+    #         x=alt.X("mentions", title="Mention Volume"),
+    #         y=alt.Y("negative_association_pct", title="% Negative Context", axis=alt.Axis(format="%")),
+    #         size=alt.Size("mentions", scale=alt.Scale(range=[100, 1500])),
+    #         color=alt.Color("competitor:N", title="Competitor"),
+    #         tooltip=[
+    #             alt.Tooltip("competitor:N", title="Competitor"),
+    #             alt.Tooltip("mentions:Q", title="Mentions"),
+    #             alt.Tooltip("negative_association_pct:Q", title="Neg. %", format=".1%"),
+    #         ],
+    #     )
+    # ).properties(height=450)
+
+    # st.altair_chart(chart, use_container_width=True)
+
+    # # Chart: Option 2 — Bubble Chart With Labels Inside Circles
+    # base = alt.Chart(df).encode(
+    #     x=alt.X("mentions", title="Mention Volume"),
+    #     y=alt.Y("negative_association_pct", title="% Negative Context", axis=alt.Axis(format="%")),
+    # )
+
+    # circles = base.mark_circle(opacity=0.6).encode(
+    #     size=alt.Size("mentions", scale=alt.Scale(range=[200, 1800])),
+    #     color=alt.Color("competitor:N", legend=None),
+    # )
+
+    # labels = base.mark_text(
+    #     dy=2,  # slight downward offset
+    #     fontSize=10,
+    #     fontWeight="bold",
+    #     color="white",
+    # ).encode(text="competitor:N")
+
+    # chart = (circles + labels).properties(height=450)
+
+    # st.altair_chart(chart, use_container_width=True)
+    # Only the selected chart is rendered; the page is a fragment, so switching
+    # view reruns this page alone and the data comes from the cache
+    chart_type = st.radio("View", ["Bar", "Scatter"], horizontal=True)
+
+    if chart_type == "Bar":
+        # Chart: Option 3 — Horizontal Bar Chart (Best readability if many competitors)
+        st.vega_lite_chart(df, COMPETITION_BAR_SPEC, use_container_width=True)
+    else:
         # Option 4 — Scatter Plot With Force-Directed Label Layout (Best but more code)
-        base = alt.Chart(df).encode(
-            x=alt.X("mentions", title="Mention Volume"),
-            y=alt.Y("negative_association_pct", title="% Negative Context", axis=alt.Axis(format="%"))
-        )
+        st.vega_lite_chart(df, COMPETITION_SCATTER_SPEC, use_container_width=True)
 
-        points = base.mark_circle(size=250, opacity=0.6).encode(
-            color="competitor:N",
-            tooltip=["competitor", "mentions", alt.Tooltip("negative_association_pct", format=".1%")],
-        )
 
-        labels = base.mark_text(
-            align="left",
-            dx=10,
-            dy=0,
-            fontSize=10,
-            fontWeight="bold",
-        ).encode(text="competitor")
+# ==========================================
+# PREFETCH
+# ==========================================
+# Query, @params and job label of each page that has a fixed query. The Product
+# Features and Competitive Intel pages share the entity_boards job.
+PAGE_QUERIES = {
+    "geo_hotspots": (GEO_HOTSPOTS_QUERY, None),
+    "entity_boards": (ENTITY_BOARDS_QUERY, {"excluded": COMPETITION_EXCLUDED}),
+    "emerging_trends": (EMERGING_TRENDS_QUERY, {"cutoff": EMERGING_TRENDS_CUTOFF}),
+}
 
-        chart = (points + labels).properties(height=450)
 
-        st.altair_chart(chart, use_container_width=True)
+def load_page_data(name):
+    """
+    Runs the query of one page (cached) and returns its DataFrame.
+    """
+    query, params = PAGE_QUERIES[name]
+    return load_data_from_bq(query, params=params, page=name)
 
 
-    else:
-        st.warning("No competitor mentions found in the current dataset.")
+def load_dashboard_data():
+    """
+    Warms the cache with the query of every page in PAGE_QUERIES, in the background.
+    """
+    # Same arguments and labels as load_page_data, so these are the entries the
+    # pages read; the ones already loaded are cache hits
+    prefetch(
+        (query, params, name) for name, (query, params) in PAGE_QUERIES.items()
+    )
@@ -1,10 +1,11 @@
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
 from streamlit_extras.add_vertical_space import add_vertical_space
 from streamlit_extras.colored_header import colored_header
-from streamlit_extras.stylable_container import stylable_container
 
 # -----------------------
 # CONFIG
@@ -17,6 +18,12 @@ else:
 BASE_URI = BASE_URI if BASE_URI.endswith("/") else BASE_URI + "/"
 API_URL = BASE_URI + "predict"
 
+# Reviews are sent to the API in chunks of this size, in parallel
+PREDICT_CHUNK_SIZE = 8
+PREDICT_MAX_WORKERS = 8
+# Seconds allowed for one chunk: a hung chunk fails on its own, the others render
+PREDICT_TIMEOUT = 30
+
 st.set_page_config(
     page_title="Voicelens Review Predictor",
     layout="centered",
@@ -33,6 +40,35 @@ colored_header(
 
 add_vertical_space(2)
 
+# -----------------------
+# CARD STYLES
+# -----------------------
+# Emitted once for all the cards: a keyed st.container gets the CSS class
+# `st-key-<key>`, so the review and result cards match on their key prefix
+st.markdown(
+    """
+    <style>
+        div[class*="st-key-review_card_"] {
+            border-radius: 12px;
+            padding: 18px;
+            background-color: #F8F9FA;
+            border: 1px solid #E0E0E0;
+            box-shadow: 0px 2px 4px rgba(0,0,0,0.05);
+            margin-bottom: 10px;
+        }
+        div[class*="st-key-result_card_"] {
+            border-radius: 12px;
+            padding: 20px;
+            background-color: white;
+            border: 1px solid #D0D7DE;
+            box-shadow: 0px 3px 6px rgba(0,0,0,0.08);
+            margin-bottom: 16px;
+        }
+    </style>
+    """,
+    unsafe_allow_html=True,
+)
+
 # -----------------------
 # SESSION STATE FOR REVIEWS
 # -----------------------
@@ -48,47 +84,71 @@ def remove_review(i):
     st.session_state.reviews.pop(i)
 
 
+def predict_chunk(session, reviews):
+    """
+    Posts one chunk of reviews to the API and returns its predictions.
+    """
+    response = session.post(
+        API_URL, json={"reviews": reviews}, timeout=PREDICT_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def render_result(i, pred):
+    """
+    Displays the prediction card of review #i+1.
+    """
+    with st.container(key=f"result_card_{i}"):
+        st.markdown(f"### ✨ Review #{i+1}")
+        st.markdown(f"**📝 Text:** {pred['text']}")
+        st.markdown(f"**💬 Sentiment:** `{pred['sentiment']}`")
+
+        if "entities" in pred:
+            st.markdown("**🔍 Extracted Entities:**")
+            if pred["entities"]:
+                for ent, label in pred["entities"]:
+                    st.markdown(f"- **{ent}** — *{label}*")
+            else:
+                st.write("No relevant entities found.")
+
+
 # -----------------------
 # INPUT SECTION
 # -----------------------
 st.markdown("### ✍️ Enter Reviews")
 # st.write("API URL:", API_URL)
 
-for i, text in enumerate(st.session_state.reviews):
-    with stylable_container(
-        key=f"review_card_{i}",
-        css_styles="""
-            {
-                border-radius: 12px;
-                padding: 18px;
-                background-color: #F8F9FA;
-                border: 1px solid #E0E0E0;
-                box-shadow: 0px 2px 4px rgba(0,0,0,0.05);
-                margin-bottom: 10px;
-            }
-        """,
-    ):
-        cols = st.columns([0.9, 0.1])
-        with cols[0]:
-            st.session_state.reviews[i] = st.text_area(
-                label=f"Review #{i+1}",
-                value=st.session_state.reviews[i],
-                key=f"text_{i}",
-                placeholder="Write a customer review...",
-                label_visibility="collapsed",
-                height=80,
-            )
-        with cols[1]:
-            if len(st.session_state.reviews) > 1:
-                if st.button("🗑️", key=f"remove_{i}", help="Remove this review"):
-                    remove_review(i)
-                    st.rerun()
-
-# Add Review Button
-st.markdown("")
-add_btn_col = st.columns([0.3, 0.4, 0.3])[1]
-with add_btn_col:
-    st.button("➕ Add another review", on_click=add_review)
+
+# Editing, adding or removing a review only reruns this section
+@st.fragment
+def review_inputs():
+    for i, text in enumerate(st.session_state.reviews):
+        with st.container(key=f"review_card_{i}"):
+            cols = st.columns([0.9, 0.1])
+            with cols[0]:
+                st.session_state.reviews[i] = st.text_area(
+                    label=f"Review #{i+1}",
+                    value=st.session_state.reviews[i],
+                    key=f"text_{i}",
+                    placeholder="Write a customer review...",
+                    label_visibility="collapsed",
+                    height=80,
+                )
+            with cols[1]:
+                if len(st.session_state.reviews) > 1:
+                    if st.button("🗑️", key=f"remove_{i}", help="Remove this review"):
+                        remove_review(i)
+                        st.rerun(scope="fragment")
+
+    # Add Review Button
+    st.markdown("")
+    add_btn_col = st.columns([0.3, 0.4, 0.3])[1]
+    with add_btn_col:
+        st.button("➕ Add another review", on_click=add_review)
+
+
+review_inputs()
 
 add_vertical_space(2)
 
@@ -109,47 +169,42 @@ if run_predict:
         st.error("Please enter at least one review.")
         st.stop()
 
-    with st.spinner("Contacting AI model..."):
-        try:
-            response = requests.post(
-                API_URL,
-                json={"reviews": reviews_cleaned},
-                timeout=200,
-            )
-            response.raise_for_status()
-            predictions = response.json()
-
-        except Exception as e:
-            st.error(f"Error contacting API: {e}")
-            st.stop()
-
     st.markdown("## 📊 Results")
 
-    # DISPLAY RESULTS
-    for i, pred in enumerate(predictions):
-        with stylable_container(
-            key=f"result_card_{i}",
-            css_styles="""
-                {
-                    border-radius: 12px;
-                    padding: 20px;
-                    background-color: white;
-                    border: 1px solid #D0D7DE;
-                    box-shadow: 0px 3px 6px rgba(0,0,0,0.08);
-                    margin-bottom: 16px;
-                }
-            """,
-        ):
-            st.markdown(f"### ✨ Review #{i+1}")
-            st.markdown(f"**📝 Text:** {pred['text']}")
-            st.markdown(f"**💬 Sentiment:** `{pred['sentiment']}`")
-
-            if "entities" in pred:
-                st.markdown("**🔍 Extracted Entities:**")
-                if pred["entities"]:
-                    for ent, label in pred["entities"]:
-                        st.markdown(f"- **{ent}** — *{label}*")
-                else:
-                    st.write("No relevant entities found.")
-
-    st.success("🎉 Predictions complete!")
+    # One placeholder per chunk, in review order: chunks are rendered as soon as
+    # their predictions come back, whatever order they complete in
+    chunks = [
+        reviews_cleaned[start : start + PREDICT_CHUNK_SIZE]
+        for start in range(0, len(reviews_cleaned), PREDICT_CHUNK_SIZE)
+    ]
+    slots = [st.container() for _ in chunks]
+    failed = False
+
+    # One keep-alive session per run, shared by this run's pool threads only, so
+    # the TCP/TLS handshake is paid once per worker connection
+    with st.spinner("Contacting AI model..."), requests.Session() as session:
+        session.mount("https://", HTTPAdapter(pool_maxsize=PREDICT_MAX_WORKERS))
+        session.mount("http://", HTTPAdapter(pool_maxsize=PREDICT_MAX_WORKERS))
+        with ThreadPoolExecutor(
+            max_workers=min(PREDICT_MAX_WORKERS, len(chunks))
+        ) as pool:
+            futures = {
+                pool.submit(predict_chunk, session, chunk): idx
+                for idx, chunk in enumerate(chunks)
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                with slots[idx]:
+                    try:
+                        predictions = future.result()
+                    except Exception as e:
+                        st.error(f"Error contacting API: {e}")
+                        failed = True
+                        continue
+
+                    # DISPLAY RESULTS
+                    for offset, pred in enumerate(predictions):
+                        render_result(idx * PREDICT_CHUNK_SIZE + offset, pred)
+
+    if not failed:
+        st.success("🎉 Predictions complete!")
@@ -1,6 +1,91 @@
 import streamlit as st
 
 from connect.bq import init_connection
+from pages.pages import (
+    BQ_DAILY_REF,
+    BQ_ENTITIES_REF,
+    BQ_SOURCE_TABLE_REF,
+    BQ_TABLE_REF,
+)
+
+# --- Derived tables ---
+# extracted_entities is stored as the string form (Python repr) of a list of tuples:
+#   [('text', 'LABEL'), ("it's", 'LABEL')]
+# It is parsed once here into ARRAY<STRUCT<text, label>>, so the pages UNNEST a
+# native column instead of running REGEXP_EXTRACT_ALL over the string on every query.
+#   \((?:'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"), '[A-Z_]+'\)  -> one tuple
+# repr switches to double quotes when the text contains a single quote, and
+# backslash-escapes the quote when the text contains both (e.g. 'it\'s "x"'), so
+# both alternatives accept escapes; the text is then unescaped (\x -> x).
+# The table is partitioned by month of review_day and clustered on the columns the
+# pages filter and group on, so date-bounded queries only scan the partitions they
+# touch. Monthly, because a CTAS may write at most 4,000 partitions: daily ones
+# would cap the history at about 11 years, monthly ones at over 300.
+# (Replacing a table with a different partitioning spec fails: drop it once first.)
+# predicted_sentiment is lowercased here, once, so every query compares it with
+# plain equality ('positive', 'negative', 'neutral') and no LOWER() per row.
+INSIGHTS_V2_QUERY = r'''
+    CREATE OR REPLACE TABLE {target}
+    PARTITION BY DATE_TRUNC(review_day, MONTH)
+    CLUSTER BY predicted_sentiment, predicted_topic, location
+    AS
+    SELECT
+        * EXCEPT(extracted_entities, predicted_sentiment),
+        LOWER(predicted_sentiment) as predicted_sentiment,
+        DATE(review_date) as review_day,
+        ARRAY(
+            SELECT AS STRUCT
+                REGEXP_REPLACE(
+                    REGEXP_EXTRACT(pair, r"""^\(['"](.*)['"], '[A-Z_]+'\)$"""),
+                    r"\\(.)", r"\1"
+                ) as text,
+                REGEXP_EXTRACT(pair, r"'([A-Z_]+)'\)$") as label
+            FROM UNNEST(REGEXP_EXTRACT_ALL(extracted_entities, r"""\((?:'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"), '[A-Z_]+'\)""")) as pair
+        ) as entities
+    FROM {source}
+'''
+
+# Additive daily counts, orders of magnitude smaller than the review table.
+# Built from the _v2 table, so it must run after INSIGHTS_V2_QUERY.
+# Too small to be worth partitioning: it is only clustered, on the columns the
+# pages filter on (Root Cause: sentiment and review_day; Geo Hotspots:
+# is_country_code), so those reads skip the blocks that cannot match.
+# Emerging Trends reads the whole rollup.
+# is_country_code flags the 2-letter locations Geo Hotspots keeps.
+# (Replacing a table with a different partitioning spec fails: drop it once first.)
+DAILY_ROLLUP_QUERY = """
+    CREATE OR REPLACE TABLE {target}
+    CLUSTER BY sentiment, is_country_code, review_day
+    AS
+    SELECT
+        review_day,
+        predicted_topic,
+        predicted_sentiment as sentiment,
+        location,
+        COALESCE(LENGTH(location) = 2, FALSE) as is_country_code,
+        COUNT(review_id) as n,
+        COUNTIF(predicted_sentiment = 'negative') as neg
+    FROM {source}
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+# One row per entity mention with only the columns the leaderboards need, so they
+# scan a narrow table instead of unnesting `entities` across the review table.
+# Clustered on the label the pages filter on. Built from the _v2 table as well.
+ENTITIES_QUERY = """
+    CREATE OR REPLACE TABLE {target}
+    CLUSTER BY entity_label
+    AS
+    SELECT
+        review_id,
+        review_day,
+        predicted_sentiment,
+        location,
+        TRIM(entity.text) as entity_text,
+        entity.label as entity_label
+    FROM {source},
+    UNNEST(entities) as entity
+"""
 
 
 # Add this temporarily to check table names
@@ -21,3 +106,21 @@ def list_tables_debug():
 
     except Exception as e:
         st.error(f"Error listing tables: {e}")
+
+
+def refresh_derived_tables():
+    """
+    Rebuilds the derived tables the dashboard reads from the source table.
+    Run it after each ingestion (`make bq_refresh_tables`), or paste the SQL
+    into a BigQuery scheduled query.
+    """
+    client = init_connection()
+    client.query(
+        INSIGHTS_V2_QUERY.format(source=BQ_SOURCE_TABLE_REF, target=BQ_TABLE_REF)
+    ).result()
+    client.query(
+        DAILY_ROLLUP_QUERY.format(source=BQ_TABLE_REF, target=BQ_DAILY_REF)
+    ).result()
+    client.query(
+        ENTITIES_QUERY.format(source=BQ_TABLE_REF, target=BQ_ENTITIES_REF)
+    ).result()